@@ -1,33 +1,202 @@
 import streamlit as st
-from pypdf import PdfReader
-import io
+import os
+import contextlib
+import itertools
+import math
+import hashlib
+import mmap
+import tempfile
+import shutil
+from pathlib import Path
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import requests
-import time
+import json
+from pdf_extraction import PdfExtractionError, extract_page_range, split_page_ranges
+from retrieval import build_index, chunk_offsets, embed_query, get_chunk, top_k_chunks, utf8_offsets
+
+# PDFium is not thread-safe, so PDFs are extracted in separate processes
+EXTRACTION_WORKERS = min(8, os.cpu_count() or 1)
+# PDF excerpts sent with each question: the best-scoring chunks that fit the token budget
+MAX_CONTEXT_CHUNKS = 10
+MAX_CONTEXT_TOKENS = 2500
+# Rough average for English text; used to estimate tokens without a model-specific tokenizer
+CHARS_PER_TOKEN = 4
+# OpenRouter keeps no conversation state, so only the most recent messages are resent each turn
+MAX_HISTORY_MESSAGES = 10
+# Extracted text is kept on disk, keyed by its SHA-256, instead of in each user's session state
+MAX_CACHED_PDF_TEXTS = 64
 
 # --- Helper Functions ---
 
+@st.cache_resource
+def get_extraction_pool():
+    """Returns one process-wide worker pool for PDF extraction."""
+    # Forking from the multithreaded Streamlit server can deadlock the children
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, mp_context=multiprocessing.get_context(start_method))
+
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
 def get_pdfs_text(pdf_docs_bytes):
-    """Extracts text from a list of PDF files."""
-    text = ""
-    for pdf_bytes in pdf_docs_bytes:
-        try:
-            pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
-        except Exception as e:
-            st.error(f"Error reading a PDF: {e}")
-    return text
-
-
-def get_openrouter_response(api_key, pdf_text, chat_history, question):
-    """Gets a response from the OpenRouter API based on PDF text and chat history."""
+    """Extracts text from a tuple of PDF files, cached on their raw bytes.
+
+    Raises PdfExtractionError if any PDF fails, so that failures are retried rather than cached.
+    """
+    executor = get_extraction_pool()
+    parts = []
+    errors = []
+    try:
+        # Workers read the PDFs from disk, so each upload is written once instead of
+        # being pickled into every task
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_paths = []
+            for i, pdf_bytes in enumerate(pdf_docs_bytes):
+                pdf_path = os.path.join(tmp_dir, f"{i}.pdf")
+                with open(pdf_path, "wb") as f:
+                    f.write(pdf_bytes)
+                pdf_paths.append(pdf_path)
+
+            # Opening a PDF by path is cheap, so read every page count first and then
+            # split each PDF across all workers
+            page_counts = [executor.submit(extract_page_range, pdf_path, 0, 0) for pdf_path in pdf_paths]
+
+            pdf_futures = []
+            for pdf_path, page_count in zip(pdf_paths, page_counts):
+                try:
+                    _, n_pages = page_count.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                pdf_futures.append([
+                    executor.submit(extract_page_range, pdf_path, start, stop)
+                    for start, stop in split_page_ranges(0, n_pages, EXTRACTION_WORKERS)
+                ])
+
+            for futures in pdf_futures:
+                try:
+                    parts.append("\n".join(future.result()[0] for future in futures))
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    errors.append(e)
+    except BrokenProcessPool as e:
+        # A worker died (e.g. killed for using too much memory); start a fresh pool next time
+        executor.shutdown(wait=False)
+        get_extraction_pool.clear()
+        raise PdfExtractionError([e], "")
+
+    if errors:
+        raise PdfExtractionError(errors, "\n".join(parts))
+    return "\n".join(parts)
+
+
+@st.cache_resource(on_release=lambda cache_dir: shutil.rmtree(cache_dir, ignore_errors=True))
+def get_pdf_text_cache_dir():
+    """Returns the process-wide directory of extracted texts.
+
+    mkdtemp gives it an unpredictable name and makes it accessible to this user only, so other
+    users of the machine can neither read the texts nor plant their own.
+    """
+    return Path(tempfile.mkdtemp(prefix="pdf-chatbot-text-"))
+
+
+def get_pdf_text_path(pdf_hash):
+    """Returns the on-disk cache path of the extracted text with the given hash."""
+    return get_pdf_text_cache_dir() / f"{pdf_hash}.txt"
+
+
+def get_cached_mtime(path):
+    """Returns the mtime of a cached text, or -inf if another session has just deleted it."""
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return float("-inf")
+
+
+def store_pdf_text(pdf_text):
+    """Writes extracted text to the on-disk cache if it is not there yet, returning its hash."""
+    data = pdf_text.encode("utf-8")
+    pdf_hash = hashlib.sha256(data).hexdigest()
+    path = get_pdf_text_path(pdf_hash)
+    try:
+        # Already cached: refresh its mtime. Unlike Path.touch(), os.utime never creates a file,
+        # so a text evicted by another session in the meantime is rewritten below
+        if os.path.getsize(path) == len(data):
+            os.utime(path)
+            return pdf_hash
+    except FileNotFoundError:
+        pass
+
+    cache_dir = get_pdf_text_cache_dir()
+    # Write to a temporary file first so other sessions never read a partial text
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_file.name, path)
+
+    # Evict the least recently used texts. Other sessions may be evicting concurrently, and on
+    # Windows a text another session has mapped cannot be deleted; both are left to a later pass
+    cached_paths = sorted(cache_dir.glob("*.txt"), key=get_cached_mtime, reverse=True)
+    for old_path in cached_paths[MAX_CACHED_PDF_TEXTS:]:
+        with contextlib.suppress(OSError):
+            old_path.unlink()
+    return pdf_hash
+
+
+def read_pdf_chunks(pdf_hash, byte_offsets, indices):
+    """Reads the given chunks of a cached PDF text, mapping the file rather than loading all of it.
+
+    Raises FileNotFoundError (or ValueError for an empty file) if the text is no longer cached.
+    """
+    path = get_pdf_text_path(pdf_hash)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunks = [get_chunk(data, byte_offsets, i) for i in indices]
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(path)
+    return chunks
+
+
+def retrieve_context(question):
+    """Returns the most relevant processed PDF chunks that fit in the context token budget.
+
+    Returns None if the processed text has been evicted from the on-disk cache.
+    """
+    query_vector = embed_query(question, st.session_state.chunk_index.idf)
+    top_indices = top_k_chunks(st.session_state.chunk_index, query_vector, MAX_CONTEXT_CHUNKS)
+    try:
+        chunks = read_pdf_chunks(st.session_state.pdf_hash, st.session_state.chunk_offsets, top_indices)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    remaining_chars = MAX_CONTEXT_TOKENS * CHARS_PER_TOKEN
+    parts = []
+    for chunk in chunks:
+        if len(chunk) > remaining_chars:
+            continue
+        parts.append(chunk)
+        remaining_chars -= len(chunk)
+    return "\n\n".join(parts)
+
+
+@st.cache_resource
+def get_http_session():
+    """Returns one process-wide HTTP session so OpenRouter connections are kept alive between questions."""
+    session = requests.Session()
+    session.headers.update({
+        "HTTP-Referer": "http://localhost:8501",  # Change to your Streamlit app URL when deployed
+        "X-Title": "PDF Chatbot Assistant"
+    })
+    return session
+
+
+def get_openrouter_response(api_key, pdf_context, chat_history, question):
+    """Streams a response from the OpenRouter API based on relevant PDF text and chat history."""
     try:
         url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": "http://localhost:8501",  # Change to your Streamlit app URL when deployed
-            "X-Title": "PDF Chatbot Assistant"
-        }
+        headers = {"Authorization": f"Bearer {api_key}"}
 
         # Build the conversation context
         messages = [
@@ -42,38 +211,45 @@ def get_openrouter_response(api_key, pdf_text, chat_history, question):
                     "If the information cannot be found, say 'Information not available' in the requested language (or in English by default).\n"
                     "Do not use any external knowledge."
                 )
-            },
-            {"role": "system", "content": f"PDF Content:\n---\n{pdf_text}\n---"}
+            }
         ]
 
-        # Add chat history
-        for message in chat_history:
+        # Add recent chat history. The window start moves in steps of half its size, so the
+        # prompt prefix stays the same for several turns and providers can serve it from their cache
+        step = MAX_HISTORY_MESSAGES // 2
+        start = math.ceil(max(0, len(chat_history) - MAX_HISTORY_MESSAGES) / step) * step
+        for message in chat_history[start:]:
             messages.append({"role": message["role"], "content": message["content"]})
 
-        # Add the latest user question
-        messages.append({"role": "user", "content": question})
+        # Add the latest user question with the PDF excerpts retrieved for it. They change every
+        # turn, so they go last to keep the cacheable prefix above intact
+        messages.append({"role": "user", "content": f"PDF Content:\n---\n{pdf_context}\n---\n\nQuestion: {question}"})
 
         payload = {
             "model": "mistralai/mistral-small-3.2-24b-instruct:free",  # You can change this to another model on OpenRouter
             "messages": messages,
             "temperature": 0.7,
+            "stream": True,
         }
 
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-
-        return result["choices"][0]["message"]["content"].strip()
+        with get_http_session().post(url, headers=headers, json=payload, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            # Server-sent events: "data: {...}" lines, ": ..." keep-alive comments, then "data: [DONE]"
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):].decode("utf-8")
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"].get("message", chunk["error"]))
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
 
     except Exception as e:
-        return f"An error occurred while contacting OpenRouter: {e}"
-
-
-def stream_response(text):
-    """Yields text word by word for a streaming effect."""
-    for word in text.split():
-        yield word + " "
-        time.sleep(0.05)
+        yield f"An error occurred while contacting OpenRouter: {e}"
 
 
 # --- Streamlit App ---
@@ -100,9 +276,18 @@ with st.sidebar:
         st.success(f"{len(uploaded_files)} PDF(s) uploaded successfully!")
         if st.button("Process Documents"):
             with st.spinner("Processing documents..."):
-                pdf_docs_bytes = [file.getvalue() for file in uploaded_files]
-                # Store PDF text in session state
-                st.session_state.pdf_text = get_pdfs_text(pdf_docs_bytes)
+                pdf_docs_bytes = tuple(file.getvalue() for file in uploaded_files)
+                try:
+                    pdf_text = get_pdfs_text(pdf_docs_bytes)
+                except PdfExtractionError as e:
+                    for error in e.errors:
+                        st.error(f"Error reading a PDF: {error}")
+                    pdf_text = e.partial_text
+                offsets = chunk_offsets(pdf_text)
+                # Store the PDF text's cache key, chunk boundaries and chunk index in session state
+                st.session_state.pdf_hash = store_pdf_text(pdf_text) if pdf_text else None
+                st.session_state.chunk_offsets = utf8_offsets(pdf_text, offsets)
+                st.session_state.chunk_index = build_index(pdf_text, offsets)
                 # Initialize chat history
                 st.session_state.messages = [{"role": "assistant", "content": "I've processed the documents. What would you like to know?"}]
             st.success("Documents processed!")
@@ -123,16 +308,24 @@ if prompt := st.chat_input("Ask a question about the PDF(s)"):
 
     if not api_key:
         st.warning("API Key not configured. Please add it to your Streamlit secrets to continue.")
-    elif "pdf_text" not in st.session_state or not st.session_state.pdf_text:
+    elif "pdf_hash" not in st.session_state or not st.session_state.pdf_hash:
         st.warning("Please upload and process at least one PDF document first.")
     else:
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                response = get_openrouter_response(
-                    api_key, 
-                    st.session_state.pdf_text, 
-                    st.session_state.messages[:-1],
-                    prompt
-                )
-            st.write_stream(stream_response(response))
-        st.session_state.messages.append({"role": "assistant", "content": response})
+                pdf_context = retrieve_context(prompt)
+                if pdf_context is not None:
+                    stream = get_openrouter_response(
+                        api_key, 
+                        pdf_context, 
+                        st.session_state.messages[:-1],
+                        prompt
+                    )
+                    # Keep the spinner up until the first delta arrives, then stream the rest
+                    first_delta = next(stream, "")
+            if pdf_context is None:
+                st.warning("The processed documents have expired from the cache. Please process them again.")
+            else:
+                response = st.write_stream(itertools.chain([first_delta], stream))
+        if pdf_context is not None:
+            st.session_state.messages.append({"role": "assistant", "content": response})
@@ -0,0 +1,45 @@
+"""PDF text extraction workers and the page ranges they are given.
+
+Kept out of app.py so that worker processes can import them: Streamlit runs
+app.py as a script, and functions defined there cannot be pickled.
+"""
+import pypdfium2 as pdfium
+
+# Large PDFs are split into page ranges of at least this many pages per worker task
+MIN_PAGES_PER_TASK = 50
+
+
+class PdfExtractionError(Exception):
+    """Raised when some PDFs could not be read; carries the text of the ones that could."""
+
+    def __init__(self, errors, partial_text):
+        super().__init__("; ".join(str(e) for e in errors))
+        self.errors = errors
+        self.partial_text = partial_text
+
+
+def extract_page_range(pdf_path, start, stop):
+    """Extracts the text of pages [start, stop) of a PDF file, returning it with the PDF's page count."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        n_pages = len(pdf)
+        parts = []
+        for index in range(start, min(stop, n_pages)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "\n".join(parts), n_pages
+    finally:
+        pdf.close()
+
+
+def split_page_ranges(start, stop, max_ranges):
+    """Splits pages [start, stop) into at most max_ranges contiguous (start, stop) page ranges."""
+    n_pages = stop - start
+    if n_pages <= 0:
+        return []
+    n_ranges = max(1, min(max_ranges, n_pages // MIN_PAGES_PER_TASK))
+    bounds = [start + n_pages * i // n_ranges for i in range(n_ranges + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,125 @@
+"""Chunking and similarity search over extracted PDF text.
+
+Chunks are embedded as hashed TF-IDF vectors, so retrieval needs no embedding
+API and works the same for any chat model.
+"""
+import array
+import collections
+import re
+import zlib
+
+import numpy as np
+
+# Roughly 500 tokens per chunk
+CHUNK_CHARS = 2000
+# At most 2**16, so bucket indices fit in uint16
+EMBEDDING_DIM = 4096
+TOKEN_PATTERN = re.compile(r"\w+")
+# Chunks scored per block; bounds the temporaries made while scoring
+SCORE_BLOCK_ROWS = 1024
+
+# Sparse (CSR) int8 chunk embeddings: chunk i has values data[indptr[i]:indptr[i + 1]] * scales[i]
+# in the buckets indices[indptr[i]:indptr[i + 1]]. A chunk only uses a few hundred of the
+# EMBEDDING_DIM buckets, so a dense matrix would be mostly zeros.
+ChunkIndex = collections.namedtuple("ChunkIndex", ["data", "indices", "indptr", "scales", "idf"])
+
+
+def chunk_offsets(text, chunk_chars=CHUNK_CHARS):
+    """Returns an int64 array of the start offset of every chunk of text followed by len(text).
+
+    Chunks are at most chunk_chars characters and break after a sentence where possible.
+    """
+    offsets = [0]
+    while offsets[-1] < len(text):
+        start = offsets[-1]
+        stop = min(start + chunk_chars, len(text))
+        if stop < len(text):
+            # Last sentence end that leaves the chunk non-empty and within chunk_chars
+            boundary = text.rfind(".", start, stop)
+            if boundary > start:
+                stop = boundary + 1
+        offsets.append(stop)
+    return np.array(offsets, dtype=np.int64)
+
+
+def utf8_offsets(text, offsets):
+    """Converts string offsets into text to byte offsets into its UTF-8 encoding."""
+    # Encode one chunk at a time so only a chunk-sized copy exists at once
+    chunk_bytes = [len(text[start:stop].encode("utf-8")) for start, stop in zip(offsets[:-1], offsets[1:])]
+    return np.cumsum([0] + chunk_bytes, dtype=np.int64)
+
+
+def get_chunk(data, byte_offsets, index):
+    """Returns the text of one chunk, sliced from UTF-8 encoded data (bytes or an mmap)."""
+    return data[byte_offsets[index]:byte_offsets[index + 1]].decode("utf-8").strip()
+
+
+def _hashed_tokens(text):
+    """Returns the start offset and hash bucket of every word in text."""
+    # Lowercase the whole text once; "İ" is the only character whose lowercase form is longer
+    lowered = text.replace("\u0130", "i").lower()
+    starts = array.array("q")
+    buckets = array.array("q")
+    for match in TOKEN_PATTERN.finditer(lowered):
+        starts.append(match.start())
+        buckets.append(zlib.crc32(match.group().encode()) % EMBEDDING_DIM)
+    return np.frombuffer(starts, dtype=np.int64), np.frombuffer(buckets, dtype=np.int64)
+
+
+def _normalize(vectors):
+    """Scales vectors to unit length along the last axis, leaving all-zero vectors as they are."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def build_index(text, offsets):
+    """Embeds the chunks of text into a ChunkIndex."""
+    n_chunks = len(offsets) - 1
+    # Tokenize the whole document in one pass, then assign each word to the chunk it starts in
+    starts, buckets = _hashed_tokens(text)
+    chunk_ids = np.searchsorted(offsets, starts, side="right") - 1
+    # Sorted unique (chunk, bucket) pairs are the nonzero entries, already in CSR order
+    keys, counts = np.unique(chunk_ids * EMBEDDING_DIM + buckets, return_counts=True)
+    rows = keys // EMBEDDING_DIM
+    columns = keys % EMBEDDING_DIM
+
+    document_frequency = np.bincount(columns, minlength=EMBEDDING_DIM)
+    idf = (np.log((1 + n_chunks) / (1 + document_frequency)) + 1).astype(np.float32)
+    values = np.log1p(counts.astype(np.float32)) * idf[columns]
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_chunks)).astype(np.float32)
+    values /= norms[rows]
+
+    # Quantize each chunk to int8 with its own scale
+    row_max = np.zeros(n_chunks, dtype=np.float32)
+    np.maximum.at(row_max, rows, values)
+    scales = row_max / 127
+    scales[scales == 0] = 1
+    data = np.round(values / scales[rows]).astype(np.int8)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_chunks))))
+    return ChunkIndex(data, columns.astype(np.uint16), indptr, scales, idf)
+
+
+def embed_query(question, idf):
+    """Embeds a question into the same space as the chunks it will be compared against."""
+    _, buckets = _hashed_tokens(question)
+    counts = np.bincount(buckets, minlength=EMBEDDING_DIM).astype(np.float32)
+    return _normalize(np.log1p(counts) * idf)
+
+
+def top_k_chunks(index, query_vector, k):
+    """Returns the indices of the k chunks most similar to the query, best first."""
+    query_vector = query_vector.astype(np.float32, copy=False)
+    n_chunks = len(index.scales)
+    scores = np.empty(n_chunks, dtype=np.float32)
+    for start in range(0, n_chunks, SCORE_BLOCK_ROWS):
+        stop = min(start + SCORE_BLOCK_ROWS, n_chunks)
+        lo, hi = index.indptr[start], index.indptr[stop]
+        products = index.data[lo:hi] * query_vector[index.indices[lo:hi]]
+        rows = np.repeat(np.arange(stop - start), np.diff(index.indptr[start:stop + 1]))
+        scores[start:stop] = np.bincount(rows, weights=products, minlength=stop - start)
+    scores *= index.scales
+    if k >= len(scores):
+        return np.argsort(-scores)
+    # Select the top k in O(N), then sort only those
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top])]
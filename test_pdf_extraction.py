@@ -0,0 +1,32 @@
+import pytest
+
+from pdf_extraction import MIN_PAGES_PER_TASK, split_page_ranges
+
+
+def test_no_pages():
+    assert split_page_ranges(0, 0, 8) == []
+    assert split_page_ranges(5, 3, 8) == []
+
+
+def test_small_pdf_is_one_range():
+    assert split_page_ranges(0, 3, 8) == [(0, 3)]
+    assert split_page_ranges(0, 2 * MIN_PAGES_PER_TASK - 1, 8) == [(0, 2 * MIN_PAGES_PER_TASK - 1)]
+
+
+def test_ranges_have_at_least_min_pages():
+    assert split_page_ranges(0, 2 * MIN_PAGES_PER_TASK, 8) == [
+        (0, MIN_PAGES_PER_TASK),
+        (MIN_PAGES_PER_TASK, 2 * MIN_PAGES_PER_TASK),
+    ]
+
+
+@pytest.mark.parametrize("start, stop, max_ranges", [(0, 1000, 8), (10, 1007, 3), (0, 137, 1), (7, 400, 16)])
+def test_ranges_cover_pages_in_order(start, stop, max_ranges):
+    ranges = split_page_ranges(start, stop, max_ranges)
+    assert 1 <= len(ranges) <= max_ranges
+    assert ranges[0][0] == start and ranges[-1][1] == stop
+    assert all(a[1] == b[0] for a, b in zip(ranges[:-1], ranges[1:]))
+    sizes = [range_stop - range_start for range_start, range_stop in ranges]
+    assert max(sizes) - min(sizes) <= 1
+    if len(ranges) > 1:
+        assert min(sizes) >= MIN_PAGES_PER_TASK
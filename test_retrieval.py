@@ -0,0 +1,68 @@
+import numpy as np
+
+from retrieval import (
+    EMBEDDING_DIM,
+    build_index,
+    chunk_offsets,
+    embed_query,
+    get_chunk,
+    top_k_chunks,
+    utf8_offsets,
+)
+
+TEXT = " ".join(
+    f"Sentence {i} is about {'cats' if i % 3 else 'dogs'} and topic {i % 17}, café {'ü' * (i % 5)} 日本 {i}."
+    for i in range(2000)
+)
+
+
+def dense_scores(index, query_vector):
+    """Scores every chunk against the query with a dense float matrix rebuilt from the index."""
+    n_chunks = len(index.scales)
+    dense = np.zeros((n_chunks, EMBEDDING_DIM), dtype=np.float64)
+    for i in range(n_chunks):
+        start, stop = index.indptr[i], index.indptr[i + 1]
+        dense[i, index.indices[start:stop]] = index.data[start:stop] * np.float64(index.scales[i])
+    return dense @ query_vector
+
+
+def test_chunks_cover_text():
+    offsets = chunk_offsets(TEXT, chunk_chars=500)
+    assert offsets[0] == 0 and offsets[-1] == len(TEXT)
+    assert np.all(np.diff(offsets) > 0)
+    assert np.all(np.diff(offsets) <= 500)
+    assert "".join(TEXT[a:b] for a, b in zip(offsets[:-1], offsets[1:])) == TEXT
+
+
+def test_chunk_offsets_of_empty_text():
+    assert chunk_offsets("").tolist() == [0]
+
+
+def test_utf8_offsets_match_string_slices():
+    offsets = chunk_offsets(TEXT, chunk_chars=500)
+    byte_offsets = utf8_offsets(TEXT, offsets)
+    data = TEXT.encode("utf-8")
+    assert byte_offsets[-1] == len(data)
+    for i, (a, b) in enumerate(zip(offsets[:-1], offsets[1:])):
+        assert data[byte_offsets[i]:byte_offsets[i + 1]].decode("utf-8") == TEXT[a:b]
+        assert get_chunk(data, byte_offsets, i) == TEXT[a:b].strip()
+
+
+def test_sparse_top_k_matches_dense():
+    offsets = chunk_offsets(TEXT, chunk_chars=500)
+    index = build_index(TEXT, offsets)
+    for question in ["dogs and topic 3", "café üü", "Sentence 1234", "日本 cats", "nothing matches zzz"]:
+        query_vector = embed_query(question, index.idf)
+        scores = dense_scores(index, query_vector)
+        top = top_k_chunks(index, query_vector, 5)
+        assert len(top) == 5
+        # Equal up to float32 rounding: the k-th best dense score is no better than any chosen chunk's
+        assert np.all(scores[top] >= np.sort(scores)[-5] - 1e-5)
+        assert np.all(np.diff(scores[top]) <= 1e-5)
+
+
+def test_top_k_with_k_above_chunk_count():
+    offsets = chunk_offsets(TEXT[:1500], chunk_chars=500)
+    index = build_index(TEXT[:1500], offsets)
+    top = top_k_chunks(index, embed_query("cats", index.idf), 10)
+    assert sorted(top.tolist()) == list(range(len(offsets) - 1))